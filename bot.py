@@ -1,6 +1,7 @@
 import asyncio
-import json
+import functools
 import logging
+import secrets
 from pathlib import Path
 
 from aiogram import Bot, Dispatcher, types
@@ -8,8 +9,12 @@ from aiogram.exceptions import TelegramAPIError, TelegramRetryAfter
 from aiogram.filters import Command
 from aiogram.types import InlineKeyboardButton
 from aiogram.utils.keyboard import InlineKeyboardBuilder
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+from aiohttp import web
+from aiolimiter import AsyncLimiter
 from environs import Env
-from parser import fetch_new_apartments
+from jsonshim import json_loads, json_dumps
+from parser import Apartment, fetch_new_apartments
 
 # ---------- Логирование ----------
 logging.basicConfig(
@@ -25,13 +30,27 @@ TG_TOKEN = env.str("TG_TOKEN")
 CHAT_ID = env.str("CHAT_ID")
 ALLOWED_USER_IDS = env.list("ALLOWED_USER_IDS", subcast=int)
 
+# Если задан WEBHOOK_URL — апдейты приходят вебхуком (событийно),
+# иначе остаётся long polling
+WEBHOOK_URL = env.str("WEBHOOK_URL", "")
+WEBHOOK_HOST = env.str("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = env.int("WEBHOOK_PORT", 8080)
+WEBHOOK_PATH = env.str("WEBHOOK_PATH", "") or f"/webhook/{secrets.token_urlsafe(16)}"
+WEBHOOK_SECRET = env.str("WEBHOOK_SECRET", "") or secrets.token_urlsafe(32)
+
 CONFIG_PATH = "config.json"
 PUBLISHED_IDS_PATH = "published_ids.json"
+PUBLISHED_IDS_LOG_PATH = "published_ids.log"
 POLL_INTERVAL = 3600
 
 bot = Bot(token=TG_TOKEN)
 dp = Dispatcher()
 
+# Отправки идут параллельно, но не больше 3 одновременно
+# и не больше 20 сообщений в минуту (лимит Telegram для группового чата)
+send_semaphore = asyncio.Semaphore(3)
+send_limiter = AsyncLimiter(20, 60)
+
 
 # ---------- Utility для изменения конфига и админ проверки ----------
 def admin_only(func):
@@ -44,19 +63,66 @@ def admin_only(func):
     return wrapper
 
 
+# Конфиг держим в памяти: этот процесс — единственный, кто его меняет
+_CONFIG_CACHE: dict | None = None
+
+
+def get_config() -> dict:
+    global _CONFIG_CACHE
+    if _CONFIG_CACHE is None:
+        config_file = Path(CONFIG_PATH)
+        if not config_file.exists():
+            default_config = {"search_params": {"FRadius": 5, "FAreaOverAllMin": 60, "FPriceMax": 1200, "pet_friendly": 1}}
+            config_file.write_bytes(json_dumps(default_config, indent=True))
+            logger.info("Создан дефолтный config.json")
+            _CONFIG_CACHE = default_config
+        else:
+            _CONFIG_CACHE = json_loads(config_file.read_bytes())
+    return _CONFIG_CACHE
+
+
 def update_config_param(param: str, value: int):
-    config_file = Path(CONFIG_PATH)
-    config = json.loads(config_file.read_text(encoding="utf-8"))
+    config = get_config()
     if param in config["search_params"]:
         config["search_params"][param] = value
-        config_file.write_text(json.dumps(config, ensure_ascii=False, indent=2), encoding="utf-8")
+        Path(CONFIG_PATH).write_bytes(json_dumps(config, indent=True))
         logger.info(f"Настройка {param} обновлена на {value}")
         return True
     logger.warning(f"Не удалось обновить {param}")
     return False
 
 
+# ---------- Published ids ----------
+def load_published_ids() -> set:
+    """Загружает отправленные id: JSON-снапшот + append-лог (после падений)"""
+    ids = set()
+    snapshot = Path(PUBLISHED_IDS_PATH)
+    if snapshot.exists():
+        ids.update(json_loads(snapshot.read_bytes()))
+    log_file = Path(PUBLISHED_IDS_LOG_PATH)
+    if log_file.exists():
+        ids.update(
+            line.strip()
+            for line in log_file.read_text(encoding="utf-8").splitlines()
+            if line.strip()
+        )
+    return ids
+
+
+def append_published_id(apt_id: str):
+    """Дозаписывает один id в лог — O(1) вместо перезаписи всего JSON"""
+    with open(PUBLISHED_IDS_LOG_PATH, "a", encoding="utf-8") as f:
+        f.write(apt_id + "\n")
+
+
+def compact_published_ids(published_ids: set):
+    """Раз в цикл переписывает снапшот целиком и очищает лог"""
+    Path(PUBLISHED_IDS_PATH).write_bytes(json_dumps(sorted(published_ids)))
+    Path(PUBLISHED_IDS_LOG_PATH).write_text("", encoding="utf-8")
+
+
 # ---------- Инлайн меню ----------
+@functools.lru_cache(maxsize=1)
 def settings_menu():
     kb = InlineKeyboardBuilder()
     kb.row(
@@ -74,13 +140,7 @@ def settings_menu():
 @dp.message(Command(commands=["start", "settings"]))
 @admin_only
 async def cmd_start(message: types.Message):
-    config_file = Path(CONFIG_PATH)
-    if not config_file.exists():
-        default_config = {"search_params": {"FRadius": 5, "FAreaOverAllMin": 60, "FPriceMax": 1200, "pet_friendly": 1}}
-        config_file.write_text(json.dumps(default_config, ensure_ascii=False, indent=2), encoding="utf-8")
-        logger.info("Создан дефолтный config.json")
-
-    config = json.loads(config_file.read_text(encoding="utf-8"))
+    config = get_config()
     params = config.get("search_params", {})
 
     pet_friendly_status = "Да" if params.get('pet_friendly', 0) == 1 else "Нет"
@@ -144,44 +204,55 @@ async def cmd_set(message: types.Message):
 
 
 # ---------- Периодический парсинг ----------
-async def send_apt(bot: Bot, chat_id: str, apt: dict, delay: float = 3.0, max_retries: int = 5):
+# Шаблон сообщения собран один раз на модуль, в send_apt остаётся подстановка
+APT_TEMPLATE = (
+    "📍 <b>{address}</b>\n"
+    "💰 Цена: {price}\n"
+    "🛏 Комнаты: {rooms}, 🏡 Площадь: {area} м²\n"
+    "🏢 Этаж: {floor}\n"
+    "🔗 <a href='{url}'>Ссылка на объявление</a>"
+)
+
+
+async def send_apt(bot: Bot, chat_id: str, apt: Apartment, max_retries: int = 5):
     """
     Отправка одного объявления с обработкой флуд-контроля.
-    delay — безопасная пауза между сообщениями в одном чате
+    Темп задают send_semaphore и send_limiter, а не фиксированная пауза.
     max_retries — максимум попыток при flood control
     """
-    text = (
-        f"📍 <b>{apt.get('address', '—')}</b>\n"
-        f"💰 Цена: {apt.get('price', '—')}\n"
-        f"🛏 Комнаты: {apt.get('rooms', '—')}, 🏡 Площадь: {apt.get('area', '—')} м²\n"
-        f"🏢 Этаж: {apt.get('floor', '—')}\n"
-        f"🔗 <a href='{apt.get('url', '#')}'>Ссылка на объявление</a>"
+    text = APT_TEMPLATE.format(
+        address=apt.address or "—",
+        price=apt.price or "—",
+        rooms=apt.rooms or "—",
+        area=apt.area or "—",
+        floor=apt.floor or "—",
+        url=apt.url or "#",
     )
 
     retries = 0
     while retries < max_retries:
         try:
-            await bot.send_message(
-                chat_id=chat_id,
-                text=text,
-                parse_mode="HTML",
-                disable_web_page_preview=True,
-                disable_notification=True
-            )
-            await asyncio.sleep(delay)
+            async with send_semaphore, send_limiter:
+                await bot.send_message(
+                    chat_id=chat_id,
+                    text=text,
+                    parse_mode="HTML",
+                    disable_web_page_preview=True,
+                    disable_notification=True
+                )
             return True
         except TelegramRetryAfter as e:
             retries += 1
-            logger.warning(f"Flood control для {apt['id']}, ждём {e.retry_after} сек (попытка {retries}/{max_retries})")
+            logger.warning(f"Flood control для {apt.id}, ждём {e.retry_after} сек (попытка {retries}/{max_retries})")
             if retries >= max_retries:
-                logger.error(f"Превышен лимит попыток для {apt['id']}")
+                logger.error(f"Превышен лимит попыток для {apt.id}")
                 return False
             await asyncio.sleep(e.retry_after)
         except TelegramAPIError as e:
-            logger.error(f"Ошибка Telegram при отправке {apt['id']}: {e}")
+            logger.error(f"Ошибка Telegram при отправке {apt.id}: {e}")
             return False
         except Exception as e:
-            logger.error(f"Неизвестная ошибка при отправке {apt['id']}: {e}", exc_info=True)
+            logger.error(f"Неизвестная ошибка при отправке {apt.id}: {e}", exc_info=True)
             return False
 
     return False
@@ -191,20 +262,17 @@ async def periodic_parser():
     """
     Основной цикл: парсинг и отправка новых квартир с безопасной задержкой и записью после каждой отправки
     """
-    published_ids_file = Path(PUBLISHED_IDS_PATH)
+    # Этот процесс — единственный писатель, поэтому грузим один раз при старте
+    # и дальше работаем с множеством в памяти.
+    # Дисковый I/O уводим в поток, чтобы не блокировать event loop.
+    published_ids = await asyncio.to_thread(load_published_ids)
 
     while True:
         try:
-            # Загружаем published_ids перед каждым циклом для синхронизации
-            if published_ids_file.exists():
-                published_ids = set(json.loads(published_ids_file.read_text(encoding="utf-8")))
-            else:
-                published_ids = set()
-
-            new_apts = await asyncio.to_thread(
-                fetch_new_apartments,
+            new_apts = await fetch_new_apartments(
                 config_path=CONFIG_PATH,
-                published_ids_path=PUBLISHED_IDS_PATH
+                published_ids_path=PUBLISHED_IDS_PATH,
+                skip_ids=published_ids
             )
 
             if new_apts is None:
@@ -217,24 +285,23 @@ async def periodic_parser():
                 await asyncio.sleep(POLL_INTERVAL)
                 continue
 
-            sent_count = 0
-            for apt in new_apts:
-                if apt["id"] in published_ids:
-                    continue
+            to_send = [apt for apt in new_apts if apt.id not in published_ids]
 
+            async def send_and_record(apt) -> bool:
                 success = await send_apt(bot, CHAT_ID, apt)
                 if success:
-                    sent_count += 1
-                    # Сохраняем прямо после успешной отправки
-                    published_ids.add(apt["id"])
-                    published_ids_file.write_text(
-                        json.dumps(list(published_ids), ensure_ascii=False, indent=2),
-                        encoding="utf-8"
-                    )
+                    # Фиксируем прямо после успешной отправки — в append-лог
+                    published_ids.add(apt.id)
+                    await asyncio.to_thread(append_published_id, apt.id)
                 else:
-                    logger.warning(f"Не удалось отправить {apt['id']}")
+                    logger.warning(f"Не удалось отправить {apt.id}")
+                return success
+
+            results = await asyncio.gather(*(send_and_record(apt) for apt in to_send))
+            sent_count = sum(results)
 
             if sent_count > 0:
+                await asyncio.to_thread(compact_published_ids, published_ids)
                 logger.info(f"✓ Отправлено {sent_count} новых объявлений")
 
         except Exception as e:
@@ -244,6 +311,33 @@ async def periodic_parser():
 
 
 # ---------- Запуск бота ----------
+async def run_webhook(bot_instance: Bot):
+    """Приём апдейтов вебхуком: никакого постоянного long polling в простое"""
+    await bot_instance.set_webhook(
+        url=f"{WEBHOOK_URL}{WEBHOOK_PATH}",
+        secret_token=WEBHOOK_SECRET,
+    )
+
+    app = web.Application()
+    SimpleRequestHandler(
+        dispatcher=dp,
+        bot=bot_instance,
+        secret_token=WEBHOOK_SECRET,
+    ).register(app, path=WEBHOOK_PATH)
+    setup_application(app, dp, bot=bot_instance)
+
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, WEBHOOK_HOST, WEBHOOK_PORT)
+    await site.start()
+    logger.info(f"Вебхук слушает на {WEBHOOK_HOST}:{WEBHOOK_PORT}{WEBHOOK_PATH}")
+
+    try:
+        await periodic_parser()
+    finally:
+        await runner.cleanup()
+
+
 async def main():
     async with Bot(token=TG_TOKEN) as bot_instance:
         try:
@@ -253,10 +347,14 @@ async def main():
             logger.error(f"Ошибка с чатом: {e}")
             return
 
-        await asyncio.gather(
-            periodic_parser(),
-            dp.start_polling(bot_instance)
-        )
+        if WEBHOOK_URL:
+            await run_webhook(bot_instance)
+        else:
+            await bot_instance.delete_webhook()
+            await asyncio.gather(
+                periodic_parser(),
+                dp.start_polling(bot_instance)
+            )
 
 
 if __name__ == "__main__":
@@ -0,0 +1,23 @@
+"""
+Общая обёртка над JSON для bot.py и parser.py.
+
+orjson (Rust) заметно быстрее stdlib json; при его отсутствии — stdlib.
+json_dumps всегда возвращает bytes, чтобы оба бэкенда вели себя одинаково.
+"""
+import json
+
+try:
+    import orjson
+
+    def json_loads(data):
+        return orjson.loads(data)
+
+    def json_dumps(obj, indent: bool = False) -> bytes:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2 if indent else 0)
+
+except ImportError:
+    def json_loads(data):
+        return json.loads(data)
+
+    def json_dumps(obj, indent: bool = False) -> bytes:
+        return json.dumps(obj, ensure_ascii=False, indent=2 if indent else None).encode("utf-8")
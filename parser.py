@@ -1,13 +1,27 @@
+import asyncio
+import atexit
+import functools
 import gc
-import json
 import logging
 import os
+import random
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
 from pathlib import Path
 from typing import List, Dict, Optional
+from urllib.parse import urlencode
 
-from bs4 import BeautifulSoup
-from playwright.sync_api import sync_playwright, Page, Browser, BrowserContext, TimeoutError as PlaywrightTimeout
+import aiohttp
+import lxml.html
+from lxml import etree
+
+# Playwright импортируется лениво в _init_browser: браузер нужен только как
+# fallback при анти-бот проверке, и в базовом RSS ему делать нечего
+PlaywrightTimeout = None  # заполняется при инициализации браузера
+
+from jsonshim import json_loads, json_dumps
 
 # -------------------- Logging --------------------
 logging.basicConfig(
@@ -18,18 +32,104 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 
+# -------------------- Config --------------------
+@functools.lru_cache(maxsize=8)
+def _load_config_cached(path: str, mtime: float) -> dict:
+    """Читает и разбирает конфиг; mtime в ключе сбрасывает кэш при изменении файла"""
+    return json_loads(Path(path).read_bytes())
+
+
+# -------------------- Apartment --------------------
+@dataclass(slots=True)
+class Apartment:
+    """
+    Одно объявление. slots=True убирает per-instance __dict__ —
+    при сотнях карточек за цикл это заметно дешевле по памяти, чем dict
+    """
+    id: str
+    url: str = ""
+    address: Optional[str] = None
+    distance: Optional[str] = None
+    price: Optional[str] = None
+    price_per_m2: Optional[str] = None
+    rooms: Optional[str] = None
+    area: Optional[str] = None
+    floor: Optional[str] = None
+    pet_friendly: bool = False
+    price_change: Optional[str] = None
+
+
 # -------------------- Parser --------------------
 class AruodasParser:
     BASE_URL = "https://ru.aruodas.lt"
 
+    # Заголовки для обычных HTTP-запросов (без браузера)
+    HTTP_HEADERS = {
+        "User-Agent": "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/131.0.0.0 Safari/537.36",
+        "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,image/apng,*/*;q=0.8",
+        # br требует пакет Brotli (есть в requirements) — без него aiohttp
+        # не сможет раскодировать ответ и HTTP-путь молча отвалится
+        "Accept-Encoding": "gzip, deflate, br",
+        "Accept-Language": "lt-LT,lt;q=0.9,en-US;q=0.8,en;q=0.7,ru;q=0.6",
+        "Upgrade-Insecure-Requests": "1",
+    }
+
+    # Маркеры анти-бот проверки (Cloudflare и т.п.) в теле ответа
+    CHALLENGE_MARKERS = ("__cf_chl", "cf-challenge", "just a moment", "checking your browser", "g-recaptcha")
+
+    # Через сколько открытых страниц пересоздавать контекст: Playwright
+    # копит объекты запросов/ответов на контексте до его закрытия.
+    # Вкладку пересоздаём чаще — это дешевле и возвращает память рендерера.
+    CONTEXT_RECYCLE_PAGES = 6
+    PAGE_RECYCLE_PAGES = 3
+
+    # Шаблоны URL, блокируемые через CDP прямо в процессе браузера:
+    # картинки, шрифты, стили и трекеры
+    CDP_BLOCKED_URLS = [
+        "*.png", "*.jpg", "*.jpeg", "*.webp", "*.gif", "*.svg", "*.ico",
+        "*.avif", "*.css", "*.woff", "*.woff2", "*.ttf", "*.otf", "*.mp4",
+        "*google-analytics*", "*analytics.js*", "*gtag*", "*googletagmanager*",
+        "*googlesyndication*", "*adservice*", "*doubleclick*",
+        "*facebook.com*", "*facebook.net*", "*hotjar*", "*mc.yandex*",
+        "*criteo*", "*adnxs*",
+    ]
+
+    # Скомпилированные XPath — компилируются один раз на класс
+    _XP_ROWS = etree.XPath("//div[contains(@class, 'list-row-v2')]")
+    _XP_SAVE = etree.XPath(".//div[contains(@class, 'advert-controls-save-v2')]/@data-id")
+    _XP_LINK = etree.XPath(".//a/@href")
+    _XP_ADDRESS = etree.XPath(".//div[contains(@class, 'list-adress-v2')]//h3")
+
+    # (тег, класс) -> поле результата
+    _FIELD_CLASSES = {
+        ("span", "accent"): "distance",
+        ("span", "list-item-price-v2"): "price",
+        ("span", "price-pm-v2"): "price_per_m2",
+        ("div", "list-RoomNum-v2"): "rooms",
+        ("div", "list-AreaOverall-v2"): "area",
+        ("div", "list-Floors-v2"): "floor",
+        ("div", "pet_friendly_info"): "pet_friendly",
+        ("div", "price-change"): "price_change",
+    }
+
     def __init__(self, config_path: str = "config.json", headless: bool = True):
-        self.config = self._load_config(config_path)
+        self._config_path = config_path
+        self._set_config(self._load_config(config_path))
         self.headless = headless
+        # Сколько циклов опроса отработал этот экземпляр (для пересоздания)
+        self.cycle_count = 0
         self.playwright = None
         self.browser = None
         self.context = None
         self.page = None
-        self._init_browser()
+        self._session: Optional[aiohttp.ClientSession] = None
+        # id, которые бот уже публиковал — такие объявления не разбираем
+        self._skip_ids: set = set()
+        # Куки, добытые браузером после анти-бот проверки, для HTTP-пути
+        self._cookies_from_browser: Optional[Dict[str, str]] = None
+        # Вся работа с sync Playwright идёт в одном выделенном потоке:
+        # его объекты привязаны к потоку, создавшему sync_playwright()
+        self._browser_executor: Optional[ThreadPoolExecutor] = None
 
     # ---------- Config ----------
     def _load_config(self, path: str) -> dict:
@@ -50,21 +150,45 @@ class AruodasParser:
             }
             self._save_config(path, default)
             return default
-        return json.loads(file.read_text(encoding="utf-8"))
+        return _load_config_cached(path, file.stat().st_mtime)
 
     def _save_config(self, path: str, config: dict):
-        Path(path).write_text(
-            json.dumps(config, ensure_ascii=False, indent=2), encoding="utf-8"
-        )
+        Path(path).write_bytes(json_dumps(config, indent=True))
+
+    def _set_config(self, config: dict):
+        """Применяет конфиг и один раз собирает базовый URL поиска"""
+        self.config = config
+        self._search_query = urlencode(config["search_params"])
+        self._url_prefix = f"{self.BASE_URL}/{config['type']}/{config['city']}"
+        self._first_page_url = f"{self._url_prefix}/?{self._search_query}"
 
     # ---------- Browser ----------
+    def _ensure_browser(self):
+        """Ленивая инициализация браузера — только когда HTTP-путь не справился"""
+        if self.page is None:
+            self._init_browser()
+
     def _init_browser(self):
         """
         Инициализация браузера Playwright с оптимизацией для памяти
         """
+        global PlaywrightTimeout
+        from playwright.sync_api import sync_playwright, TimeoutError as PlaywrightTimeout
+
         try:
             self.playwright = sync_playwright().start()
 
+            # Если задан BROWSER_CDP_URL — подключаемся к уже запущенному
+            # Chromium (chromium --remote-debugging-port=9222) и делим один
+            # процесс браузера между несколькими воркерами; у каждого парсера
+            # остаётся свой контекст с изолированными куки
+            cdp_url = os.environ.get("BROWSER_CDP_URL")
+            if cdp_url:
+                self.browser = self.playwright.chromium.connect_over_cdp(cdp_url)
+                self._new_context()
+                logger.info(f"Подключились к внешнему Chromium: {cdp_url}")
+                return
+
             # Запускаем Chromium с оптимальными флагами
             self.browser = self.playwright.chromium.launch(
                 headless=self.headless,
@@ -74,13 +198,10 @@ class AruodasParser:
                     '--no-sandbox',
                     '--disable-dev-shm-usage',  # Критично для серверов с малой памятью
                     '--disable-gpu',
-                    '--disable-software-rasterizer',
                     '--disable-extensions',
                     '--disable-background-networking',
                     '--disable-sync',
                     '--disable-translate',
-                    '--disable-features=TranslateUI',
-                    '--disable-features=BlinkGenPropertyTrees',
                     '--disable-default-apps',
                     '--disable-hang-monitor',
                     '--disable-prompt-on-repost',
@@ -98,14 +219,16 @@ class AruodasParser:
                     '--disable-breakpad',
                     '--disable-component-update',
                     '--disable-domain-reliability',
-                    '--disable-features=AudioServiceOutOfProcess,IsolateOrigins,site-per-process',
-                    '--disable-features=ImprovedCookieControls,LazyFrameLoading,GlobalMediaControls,DestroyProfileOnBrowserClose,MediaRouter,AcceptCHFrame',
+                    # Chromium учитывает только последний --disable-features,
+                    # поэтому все отключаемые фичи собраны в один флаг
+                    '--disable-features=TranslateUI,BlinkGenPropertyTrees,'
+                    'AudioServiceOutOfProcess,IsolateOrigins,site-per-process,'
+                    'ImprovedCookieControls,LazyFrameLoading,GlobalMediaControls,'
+                    'DestroyProfileOnBrowserClose,MediaRouter,AcceptCHFrame',
                     '--disable-print-preview',
                     '--disable-setuid-sandbox',
                     '--disable-site-isolation-trials',
                     '--disable-speech-api',
-                    '--disable-web-security',
-                    '--disk-cache-size=1',
                     '--media-cache-size=1',
                     '--aggressive-cache-discard',
                     '--disable-cache',
@@ -120,116 +243,7 @@ class AruodasParser:
                 chromium_sandbox=False,
             )
 
-            # Создаём контекст с минимальными настройками
-            self.context = self.browser.new_context(
-                viewport={'width': 1920, 'height': 1080},
-                user_agent='Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/131.0.0.0 Safari/537.36',
-                locale='lt-LT',
-                timezone_id='Europe/Vilnius',
-                java_script_enabled=True,
-                # Дополнительные headers для обхода Cloudflare
-                extra_http_headers={
-                    'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,image/apng,*/*;q=0.8',
-                    'Accept-Encoding': 'gzip, deflate, br',
-                    'Accept-Language': 'lt-LT,lt;q=0.9,en-US;q=0.8,en;q=0.7,ru;q=0.6',
-                    'Sec-Fetch-Dest': 'document',
-                    'Sec-Fetch-Mode': 'navigate',
-                    'Sec-Fetch-Site': 'none',
-                    'Sec-Fetch-User': '?1',
-                    'Upgrade-Insecure-Requests': '1',
-                    'sec-ch-ua': '"Not_A Brand";v="8", "Chromium";v="131", "Google Chrome";v="131"',
-                    'sec-ch-ua-mobile': '?0',
-                    'sec-ch-ua-platform': '"Linux"',
-                },
-            )
-
-            # Обход детекции автоматизации (усиленный)
-            self.context.add_init_script("""
-                // Удаляем webdriver
-                Object.defineProperty(navigator, 'webdriver', {
-                    get: () => undefined
-                });
-
-                // Маскируем Chrome headless
-                window.chrome = {
-                    runtime: {},
-                    loadTimes: function() {},
-                    csi: function() {},
-                    app: {}
-                };
-
-                // Переопределяем permissions
-                const originalQuery = window.navigator.permissions.query;
-                window.navigator.permissions.query = (parameters) => (
-                    parameters.name === 'notifications' ?
-                        Promise.resolve({ state: Notification.permission }) :
-                        originalQuery(parameters)
-                );
-
-                // Маскируем headless признаки
-                Object.defineProperty(navigator, 'plugins', {
-                    get: () => [1, 2, 3, 4, 5]
-                });
-
-                Object.defineProperty(navigator, 'languages', {
-                    get: () => ['lt-LT', 'lt', 'en-US', 'en']
-                });
-
-                // Переопределяем navigator.platform
-                Object.defineProperty(navigator, 'platform', {
-                    get: () => 'Linux x86_64'
-                });
-
-                // Добавляем fake battery API
-                navigator.getBattery = () => Promise.resolve({
-                    charging: true,
-                    chargingTime: 0,
-                    dischargingTime: Infinity,
-                    level: 1
-                });
-
-                // Переопределяем Connection API
-                Object.defineProperty(navigator, 'connection', {
-                    get: () => ({
-                        effectiveType: '4g',
-                        rtt: 50,
-                        downlink: 10,
-                        saveData: false
-                    })
-                });
-
-                // Маскируем отсутствие GPU
-                const getParameter = WebGLRenderingContext.prototype.getParameter;
-                WebGLRenderingContext.prototype.getParameter = function(parameter) {
-                    if (parameter === 37445) {
-                        return 'Intel Inc.';
-                    }
-                    if (parameter === 37446) {
-                        return 'Intel Iris OpenGL Engine';
-                    }
-                    return getParameter.call(this, parameter);
-                };
-            """)
-
-            # Блокируем ненужные ресурсы для экономии памяти и скорости
-            def block_resources(route):
-                resource_type = route.request.resource_type
-                if resource_type in ['image', 'media', 'font', 'stylesheet']:
-                    route.abort()
-                else:
-                    url = route.request.url
-                    if any(x in url for x in ['google-analytics', 'analytics.js', 'gtag', 'facebook.com', 'doubleclick']):
-                        route.abort()
-                    else:
-                        route.continue_()
-
-            self.context.route("**/*", block_resources)
-
-            self.page = self.context.new_page()
-
-            # Устанавливаем разумные таймауты
-            self.page.set_default_timeout(30000)  # 30 секунд
-            self.page.set_default_navigation_timeout(30000)
+            self._new_context()
 
             logger.info("Playwright браузер инициализирован")
 
@@ -238,150 +252,420 @@ class AruodasParser:
             self.close()
             raise
 
+    def _new_context(self, storage_state=None):
+        """
+        Создаёт контекст и вкладку. storage_state позволяет перенести куки
+        из закрываемого контекста (например, пройденную анти-бот проверку).
+        """
+        # Создаём контекст с минимальными настройками
+        self.context = self.browser.new_context(
+            storage_state=storage_state,
+            viewport={'width': 1920, 'height': 1080},
+            user_agent='Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/131.0.0.0 Safari/537.36',
+            locale='lt-LT',
+            timezone_id='Europe/Vilnius',
+            java_script_enabled=True,
+            # Дополнительные headers для обхода Cloudflare
+            extra_http_headers={
+                'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,image/apng,*/*;q=0.8',
+                'Accept-Encoding': 'gzip, deflate, br',
+                'Accept-Language': 'lt-LT,lt;q=0.9,en-US;q=0.8,en;q=0.7,ru;q=0.6',
+                'Sec-Fetch-Dest': 'document',
+                'Sec-Fetch-Mode': 'navigate',
+                'Sec-Fetch-Site': 'none',
+                'Sec-Fetch-User': '?1',
+                'Upgrade-Insecure-Requests': '1',
+                'sec-ch-ua': '"Not_A Brand";v="8", "Chromium";v="131", "Google Chrome";v="131"',
+                'sec-ch-ua-mobile': '?0',
+                'sec-ch-ua-platform': '"Linux"',
+            },
+        )
+
+        # Обход детекции автоматизации (усиленный)
+        self.context.add_init_script("""
+            // Удаляем webdriver
+            Object.defineProperty(navigator, 'webdriver', {
+                get: () => undefined
+            });
+
+            // Маскируем Chrome headless
+            window.chrome = {
+                runtime: {},
+                loadTimes: function() {},
+                csi: function() {},
+                app: {}
+            };
+
+            // Переопределяем permissions
+            const originalQuery = window.navigator.permissions.query;
+            window.navigator.permissions.query = (parameters) => (
+                parameters.name === 'notifications' ?
+                    Promise.resolve({ state: Notification.permission }) :
+                    originalQuery(parameters)
+            );
+
+            // Маскируем headless признаки
+            Object.defineProperty(navigator, 'plugins', {
+                get: () => [1, 2, 3, 4, 5]
+            });
+
+            Object.defineProperty(navigator, 'languages', {
+                get: () => ['lt-LT', 'lt', 'en-US', 'en']
+            });
+
+            // Переопределяем navigator.platform
+            Object.defineProperty(navigator, 'platform', {
+                get: () => 'Linux x86_64'
+            });
+
+            // Добавляем fake battery API
+            navigator.getBattery = () => Promise.resolve({
+                charging: true,
+                chargingTime: 0,
+                dischargingTime: Infinity,
+                level: 1
+            });
+
+            // Переопределяем Connection API
+            Object.defineProperty(navigator, 'connection', {
+                get: () => ({
+                    effectiveType: '4g',
+                    rtt: 50,
+                    downlink: 10,
+                    saveData: false
+                })
+            });
+
+            // Маскируем отсутствие GPU
+            const getParameter = WebGLRenderingContext.prototype.getParameter;
+            WebGLRenderingContext.prototype.getParameter = function(parameter) {
+                if (parameter === 37445) {
+                    return 'Intel Inc.';
+                }
+                if (parameter === 37446) {
+                    return 'Intel Iris OpenGL Engine';
+                }
+                return getParameter.call(this, parameter);
+            };
+        """)
+
+        self._new_page()
+
+        # Счётчик страниц, открытых в этом контексте (для пересоздания)
+        self._pages_since_context = 0
+
+    def _new_page(self):
+        """Открывает вкладку с таймаутами и CDP-блокировкой ресурсов"""
+        self.page = self.context.new_page()
+
+        # Блокируем ненужные ресурсы через CDP: фильтрация идёт внутри
+        # процесса браузера, без Python-колбэка на каждый запрос
+        cdp = self.context.new_cdp_session(self.page)
+        cdp.send("Network.enable", {})
+        cdp.send("Network.setBlockedURLs", {"urls": self.CDP_BLOCKED_URLS})
+
+        # Устанавливаем разумные таймауты
+        self.page.set_default_timeout(30000)  # 30 секунд
+        self.page.set_default_navigation_timeout(30000)
+
+    def _recycle_page(self):
+        """
+        Закрывает вкладку и открывает новую: память DOM на стороне рендерера
+        возвращается только при закрытии вкладки, не при навигации.
+        """
+        try:
+            self.page.close()
+        except Exception:
+            pass
+
+        self._new_page()
+        logger.info("Вкладка браузера пересоздана")
+
+    def _recycle_context(self):
+        """
+        Закрывает контекст (вместе с накопленными на нём объектами) и создаёт
+        новый, перенося куки, чтобы не проходить анти-бот проверку заново.
+        """
+        state = None
+        try:
+            state = self.context.storage_state()
+        except Exception as e:
+            logger.warning(f"Не удалось сохранить состояние контекста: {e}")
+
+        try:
+            self.context.close()
+        except Exception:
+            pass
+
+        self._new_context(storage_state=state)
+        logger.info("Контекст браузера пересоздан")
+
     # ---------- URL ----------
     def build_search_url(self, page: int = 1) -> str:
-        params = "&".join(f"{k}={v}" for k, v in self.config["search_params"].items())
         if page > 1:
-            url = f"{self.BASE_URL}/{self.config['type']}/{self.config['city']}/puslapis/{page}/?{params}"
-        else:
-            url = f"{self.BASE_URL}/{self.config['type']}/{self.config['city']}/?{params}"
-        return url
+            return f"{self._url_prefix}/puslapis/{page}/?{self._search_query}"
+        return self._first_page_url
 
     # ---------- Parsing ----------
-    def parse_all_pages(self) -> Optional[List[Dict]]:
-        all_apartments = []
-        seen_ids = set()
+    async def parse_all_pages(self, skip_ids: Optional[set] = None) -> Optional[List[Apartment]]:
+        # Конфиг могли поменять через бота между циклами — перечитываем
+        self._set_config(self._load_config(self._config_path))
+        self._skip_ids = skip_ids or set()
         max_pages = self.config.get("max_pages", 3)
 
-        for page_num in range(1, max_pages + 1):
-            url = self.build_search_url(page_num)
-            apartments = self._parse_page(url)
+        # Все страницы качаем параллельно, ограничивая число одновременных запросов
+        semaphore = asyncio.Semaphore(4)
+
+        async def fetch_one(page_num: int):
+            async with semaphore:
+                return await self._parse_page(self.build_search_url(page_num))
+
+        results = await asyncio.gather(
+            *(fetch_one(p) for p in range(1, max_pages + 1)),
+            return_exceptions=True,
+        )
+
+        # dict сохраняет порядок вставки — один lookup на квартиру
+        all_by_id: Dict[str, Apartment] = {}
+
+        for page_num, apartments in enumerate(results, start=1):
+            if isinstance(apartments, BaseException):
+                logger.error(f"Ошибка на странице {page_num}: {apartments}")
+                apartments = None
 
             if apartments is None:
                 if page_num == 1:
                     logger.error(f"Критическая ошибка на первой странице")
                     return None
-                else:
-                    logger.warning(f"Ошибка на странице {page_num} (возможно, страниц меньше {max_pages}), останавливаем парсинг")
-                    break
+                logger.warning(f"Ошибка на странице {page_num} (возможно, страниц меньше {max_pages})")
+                continue
 
             if not apartments:
-                logger.info(f"Страница {page_num} пуста, останавливаем парсинг")
-                break
+                logger.info(f"Страница {page_num} пуста")
+                continue
 
             # Дедупликация
             for apt in apartments:
-                if apt["id"] not in seen_ids:
-                    all_apartments.append(apt)
-                    seen_ids.add(apt["id"])
+                all_by_id.setdefault(apt.id, apt)
 
             logger.info(f"Страница {page_num}: найдено {len(apartments)} объявлений")
 
-            # Очистка после каждой страницы
-            del apartments
-            gc.collect()
-
-            if page_num < max_pages:
-                time.sleep(2)
+        logger.info(f"Найдено {len(all_by_id)} уникальных квартир")
+        return list(all_by_id.values())
 
-        logger.info(f"Найдено {len(all_apartments)} уникальных квартир")
-        return all_apartments
+    async def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                headers=self.HTTP_HEADERS,
+                timeout=aiohttp.ClientTimeout(total=30),
+            )
+        return self._session
 
-    def _parse_page(self, url: str) -> Optional[List[Dict]]:
+    async def _fetch_page(self, url: str) -> Optional[str]:
+        """Загрузка HTML обычным GET-запросом, без браузера"""
         try:
-            logger.info(f"Открываем страницу: {url}")
+            session = await self._get_session()
+
+            # Если браузер прошёл анти-бот проверку — забираем его куки,
+            # чтобы следующие запросы снова шли без браузера
+            if self._cookies_from_browser:
+                session.cookie_jar.update_cookies(self._cookies_from_browser)
+                self._cookies_from_browser = None
+
+            async with session.get(url) as response:
+                if response.status != 200:
+                    logger.warning(f"HTTP {response.status} при запросе {url}")
+                    return None
+                return await response.text()
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logger.warning(f"Ошибка HTTP-запроса {url}: {e}")
+            return None
+
+    def _looks_like_challenge(self, html: str) -> bool:
+        """Проверка, не вернул ли сервер анти-бот заглушку вместо списка"""
+        lowered = html[:10000].lower()
+        return any(marker in lowered for marker in self.CHALLENGE_MARKERS)
+
+    def _parse_html(self, html: str) -> List[Apartment]:
+        """Разбор HTML списка объявлений через lxml (libxml2, C)"""
+        doc = lxml.html.fromstring(html)
+        listings = self._XP_ROWS(doc)
+
+        if not listings:
+            logger.warning("Не найдено объявлений на странице")
+            return []
 
-            # Небольшая задержка перед запросом (имитация человека)
-            time.sleep(1)
+        apartments = []
+        for listing in listings:
+            apt = self._parse_apartment(listing)
+            if apt:
+                apartments.append(apt)
 
-            # Переходим на страницу (не ждём полной загрузки)
-            response = self.page.goto(url, wait_until='commit', timeout=20000)
+        return apartments
 
-            if response is None or response.status != 200:
-                logger.error(f"Ошибка загрузки страницы: статус {response.status if response else 'None'}")
+    def _parse_apartment(self, listing) -> Optional[Apartment]:
+        try:
+            ids = self._XP_SAVE(listing)
+            if not ids:
                 return None
 
-            # Ждём загрузки списка объявлений (это главное)
-            try:
-                self.page.wait_for_selector(".list-row-v2", timeout=10000)
-                logger.info("Объявления загружены")
-            except PlaywrightTimeout:
-                logger.warning("Таймаут ожидания объявлений, пробуем парсить то что есть")
-
-            # Короткая пауза для завершения рендера
-            time.sleep(1)
-
-            # Получаем HTML и парсим через BeautifulSoup
-            html = self.page.content()
-            soup = BeautifulSoup(html, "lxml")
-            listings = soup.find_all("div", class_="list-row-v2")
-
-            if not listings:
-                logger.warning("Не найдено объявлений на странице")
-                soup.decompose()
-                return []
-
-            apartments = []
-            for listing in listings:
-                apt = self._parse_apartment(listing)
-                if apt:
-                    apartments.append(apt)
-
-            # Очистка
-            soup.decompose()
-            del soup
-            del listings
-            del html
+            # Уже опубликовано — не тратим время на извлечение полей
+            if ids[0] in self._skip_ids:
+                return None
 
-            return apartments
+            hrefs = self._XP_LINK(listing)
+            url = hrefs[0].split("?")[0] if hrefs else ""
+
+            address = None
+            headers = self._XP_ADDRESS(listing)
+            if headers:
+                address = ", ".join(
+                    s.strip()
+                    for s in headers[0].itertext()
+                    if s.strip() and "км до точки" not in s
+                )
+
+            apartment = Apartment(id=ids[0], url=url, address=address)
+
+            # Один потоковый обход карточки: без промежуточных списков узлов,
+            # раскладка по полям идёт по (тег, класс)
+            for el in listing.iter("div", "span"):
+                classes = el.get("class")
+                if not classes:
+                    continue
+                for cls in classes.split():
+                    field = self._FIELD_CLASSES.get((el.tag, cls))
+                    if field is None:
+                        continue
+                    if field == "pet_friendly":
+                        apartment.pet_friendly = True
+                    elif getattr(apartment, field) is None:
+                        setattr(apartment, field, el.text_content().strip())
 
+            return apartment
         except Exception as e:
-            logger.error(f"Ошибка при парсинге страницы: {e}", exc_info=True)
+            logger.warning(f"Ошибка при парсинге объявления: {e}")
             return None
 
-    def _parse_apartment(self, listing) -> Optional[Dict]:
+    async def _parse_page(self, url: str) -> Optional[List[Apartment]]:
+        """
+        Сначала пробуем обычный HTTP-запрос (быстро, без браузера).
+        Браузер поднимаем только если сервер вернул анти-бот проверку.
+        """
+        html = await self._fetch_page(url)
+
+        if html is not None and not self._looks_like_challenge(html):
+            return self._parse_html(html)
+
+        if html is not None:
+            logger.warning("Сервер вернул анти-бот проверку, переключаемся на браузер")
+
+        # Sync Playwright нельзя звать из event loop — уводим в выделенный
+        # поток; один воркер заодно сериализует конкурирующие fallback'и
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._get_browser_executor(), self._parse_page_browser, url
+        )
+
+    def _get_browser_executor(self) -> ThreadPoolExecutor:
+        if self._browser_executor is None:
+            self._browser_executor = ThreadPoolExecutor(
+                max_workers=1, thread_name_prefix="pw-browser"
+            )
+        return self._browser_executor
+
+    def _parse_page_browser(self, url: str) -> Optional[List[Apartment]]:
         try:
-            save_btn = listing.find("div", class_="advert-controls-save-v2")
-            if not save_btn or not save_btn.get("data-id"):
+            self._ensure_browser()
+            logger.info(f"Открываем страницу: {url}")
+
+            # Небольшая случайная задержка перед запросом (имитация человека)
+            time.sleep(random.uniform(0.3, 0.8))
+
+            # Переходим на страницу; domcontentloaded — DOM уже разобран,
+            # но полной загрузки ресурсов не ждём
+            response = self.page.goto(url, wait_until='domcontentloaded', timeout=20000)
+
+            if response is None:
+                logger.error("Ошибка загрузки страницы: нет ответа")
                 return None
 
-            def text(cls, tag="div"):
-                el = listing.find(tag, class_=cls)
-                return el.get_text(strip=True) if el else None
-
-            apartment = {
-                "id": save_btn["data-id"],
-                "url": (listing.find("a", href=True) or {})
-                .get("href", "")
-                .split("?")[0],
-                "address": (
-                    ", ".join(
-                        s.strip()
-                        for s in (
-                            listing.find(
-                                "div", class_="list-adress-v2"
-                            ).h3.stripped_strings
-                        )
-                        if "км до точки" not in s
-                    )
-                    if listing.find("div", class_="list-adress-v2")
-                    else None
-                ),
-                "distance": text("accent", "span"),
-                "price": text("list-item-price-v2", "span"),
-                "price_per_m2": text("price-pm-v2", "span"),
-                "rooms": text("list-RoomNum-v2"),
-                "area": text("list-AreaOverall-v2"),
-                "floor": text("list-Floors-v2"),
-                "pet_friendly": bool(listing.find("div", class_="pet_friendly_info")),
-                "price_change": text("price-change"),
-            }
-            return apartment
+            # 403/503 — так Cloudflare отдаёт страницу проверки; её решает
+            # JS на странице, поэтому эти статусы идут в challenge-ветку
+            if response.status != 200 and response.status not in (403, 503):
+                logger.error(f"Ошибка загрузки страницы: статус {response.status}")
+                return None
+
+            # Если сервер сразу отдал готовую выдачу, берём тело сетевого
+            # ответа как есть — без ожидания селектора и прохода по DOM
+            html = response.text()
+            if response.status != 200 or self._looks_like_challenge(html):
+                # Анти-бот проверка: её решает JS на странице, поэтому ждём,
+                # пока в живом DOM появится список объявлений
+                try:
+                    self.page.wait_for_selector(".list-row-v2", state="attached", timeout=10000)
+                    logger.info("Объявления загружены")
+                except PlaywrightTimeout:
+                    logger.warning("Таймаут ожидания объявлений, пробуем парсить то что есть")
+
+                # Забираем только контейнер со списком объявлений: гонять через
+                # CDP весь DOM (шапка, скрипты, футер) незачем
+                html = self.page.evaluate(
+                    "() => {"
+                    " const el = document.querySelector("
+                    "'.search-result-list-big_thumbs, .search-result-list, #main-content, main');"
+                    " return el ? el.outerHTML : document.body.outerHTML;"
+                    " }"
+                )
+
+            # Профилактика монотонного роста памяти рендерера и контекста
+            self._pages_since_context += 1
+            if self._pages_since_context >= self.CONTEXT_RECYCLE_PAGES:
+                self._recycle_context()
+            elif self._pages_since_context % self.PAGE_RECYCLE_PAGES == 0:
+                self._recycle_page()
+
+            # Разбор — через общий lxml-путь, тот же, что и для HTTP-ответов
+            apartments = self._parse_html(html)
+
+            # Проверка пройдена — экспортируем куки контекста HTTP-пути
+            try:
+                self._cookies_from_browser = {
+                    c["name"]: c["value"] for c in self.context.cookies(self.BASE_URL)
+                }
+            except Exception as e:
+                logger.warning(f"Не удалось забрать куки из браузера: {e}")
+
+            return apartments
+
         except Exception as e:
-            logger.warning(f"Ошибка при парсинге объявления: {e}")
+            logger.error(f"Ошибка при парсинге страницы: {e}", exc_info=True)
             return None
 
     # ---------- Close ----------
+    async def aclose(self):
+        """Асинхронное закрытие: HTTP-сессия + браузер (в его потоке)"""
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+        await asyncio.to_thread(self.shutdown)
+
+    def shutdown(self):
+        """Синхронное закрытие браузера в потоке, которому он принадлежит"""
+        if self._browser_executor is not None:
+            try:
+                self._browser_executor.submit(self.close).result(timeout=15)
+            except RuntimeError:
+                # На atexit пул уже не принимает задачи (воркеры join-ятся до
+                # atexit-хуков) — закрываем прямо в текущем потоке
+                self.close()
+            except Exception as e:
+                logger.warning(f"Ошибка при закрытии браузера: {e}")
+            self._browser_executor.shutdown(wait=False)
+            self._browser_executor = None
+        else:
+            self.close()
+
     def close(self):
         """
         Полная очистка ресурсов браузера
@@ -415,11 +699,7 @@ class AruodasParser:
                     pass
                 self.playwright = None
 
-            # Небольшая пауза для завершения процессов браузера
-            time.sleep(0.5)
-
-            # Принудительная очистка памяти (дважды для надёжности)
-            gc.collect()
+            # Принудительная очистка памяти
             gc.collect()
 
             logger.info("Playwright браузер закрыт и очищен")
@@ -445,38 +725,75 @@ def log_memory_usage(stage: str):
 
 
 # -------------------- Launcher for bot --------------------
-def fetch_new_apartments(
+# Один долгоживущий парсер на процесс: браузер и HTTP-сессия переживают циклы опроса
+_PARSER: Optional[AruodasParser] = None
+_PARSER_LOCK = threading.Lock()
+
+# Через сколько циклов опроса пересоздавать парсер (профилактика утечек)
+PARSER_RECYCLE_CYCLES = 24
+
+
+def get_parser(config_path: str = "config.json", headless: bool = True) -> AruodasParser:
+    """Ленивая инициализация общего экземпляра парсера"""
+    global _PARSER
+    with _PARSER_LOCK:
+        if _PARSER is None:
+            _PARSER = AruodasParser(config_path=config_path, headless=headless)
+        return _PARSER
+
+
+def _shutdown_parser():
+    """Гасит браузер при выходе процесса, чтобы не оставлять Chromium-сирот"""
+    global _PARSER
+    if _PARSER is not None:
+        _PARSER.shutdown()
+        _PARSER = None
+
+
+atexit.register(_shutdown_parser)
+
+
+async def _recycle_parser():
+    global _PARSER
+    if _PARSER is not None:
+        await _PARSER.aclose()
+        _PARSER = None
+        gc.collect()
+
+
+async def fetch_new_apartments(
     config_path: str = "config.json",
     published_ids_path: str = "published_ids.json",
     headless: bool = True,
-) -> Optional[List[Dict]]:
+    skip_ids: Optional[set] = None,
+) -> Optional[List[Apartment]]:
     """
-    Парсит все квартиры и возвращает их БЕЗ ФИЛЬТРАЦИИ.
-    Фильтрацию делает бот, т.к. файл published_ids может измениться во время парсинга.
+    Парсит квартиры и возвращает их. Через skip_ids бот передаёт уже
+    опубликованные id — такие объявления отбрасываются ещё в парсере,
+    до извлечения полей.
     """
-    parser = None
     try:
-        log_memory_usage("До инициализации браузера")
+        log_memory_usage("До запуска парсера")
 
-        parser = AruodasParser(config_path=config_path, headless=headless)
-        log_memory_usage("После инициализации браузера")
+        parser = get_parser(config_path=config_path, headless=headless)
 
-        all_apartments = parser.parse_all_pages()
+        all_apartments = await parser.parse_all_pages(skip_ids=skip_ids)
         log_memory_usage("После парсинга всех страниц")
 
+        parser.cycle_count += 1
+
         if all_apartments is None:
-            logger.error("Критическая ошибка парсинга")
+            logger.error("Критическая ошибка парсинга, пересоздаём парсер")
+            await _recycle_parser()
             return None
 
+        if parser.cycle_count >= PARSER_RECYCLE_CYCLES:
+            logger.info(f"Плановое пересоздание парсера после {parser.cycle_count} циклов")
+            await _recycle_parser()
+
         return all_apartments
 
     except Exception as e:
         logger.error(f"Ошибка парсинга: {e}", exc_info=True)
+        await _recycle_parser()
         return None
-
-    finally:
-        if parser is not None:
-            parser.close()
-            del parser
-            gc.collect()
-            log_memory_usage("После закрытия браузера")